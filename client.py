@@ -9,6 +9,232 @@ import base64
 import struct
 import sys
 import subprocess
+import sqlite3
+import hashlib
+import time
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 64 * 1024
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.messenger_cache')
+ATTACHMENT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+PREFETCH_LIMIT = 3
+THUMBNAIL_RETRY_MS = 1500
+THUMBNAIL_RETRIES = 5
+
+class AttachmentCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db_path = os.path.join(directory, 'attachments.db')
+        
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+            
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            local_path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''')
+        conn.commit()
+        conn.close()
+        
+    def make_key(self, message):
+        #the server hash identifies the content, old messages fall back to the server path
+        if message.get('file_hash'):
+            return message['file_hash']
+        return hashlib.sha256(message['file_path'].encode('utf-8')).hexdigest()
+        
+    def get(self, key):
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute('SELECT local_path, size FROM entries WHERE key = ?', (key,)).fetchone()
+                if not row:
+                    return None
+                local_path, size = row
+                #drop entries whose file was deleted or truncated behind our back
+                if not os.path.exists(local_path) or os.path.getsize(local_path) != size:
+                    conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    conn.commit()
+                    return None
+                conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+                conn.commit()
+                return local_path
+            finally:
+                conn.close()
+                
+    def put(self, key, file_name, data, expected_hash=None):
+        digest = hashlib.sha256(data).hexdigest()
+        if expected_hash and digest != expected_hash:
+            raise ValueError(f"Integrity check failed for {file_name}")
+            
+        _, extension = os.path.splitext(file_name)
+        local_path = os.path.join(self.directory, key[:32] + extension)
+        
+        #write to a temp file first so a crash never leaves half a file in the cache.
+        #this happens outside the lock so a big write never blocks get() on the tk thread
+        temp_path = f"{local_path}.{threading.get_ident()}.part"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, local_path)
+        
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO entries (key, local_path, size, sha256, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (key, local_path, len(data), digest, time.time()))
+                self.evict(conn, key)
+                conn.commit()
+            finally:
+                conn.close()
+        return local_path
+        
+    def evict(self, conn, keep_key):
+        #least recently used files go first, the entry just added always stays
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute('''
+            SELECT key, local_path, size FROM entries
+            WHERE key != ?
+            ORDER BY last_access
+        ''', (keep_key,)).fetchall()
+        for key, local_path, size in rows:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+
+class MessageCache:
+    def __init__(self, directory, username):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        #hash the name so any username makes a safe file name
+        account = hashlib.sha256(username.encode('utf-8')).hexdigest()[:16]
+        self.db_path = os.path.join(directory, f"messages_{account}.db")
+        
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            contact TEXT NOT NULL,
+            sender TEXT,
+            content TEXT,
+            is_file BOOLEAN DEFAULT 0,
+            file_path TEXT,
+            file_hash TEXT,
+            timestamp TEXT
+        )
+        ''')
+        conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_contact
+        ON messages (contact, id)
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS contacts (
+            username TEXT PRIMARY KEY,
+            position INTEGER
+        )
+        ''')
+        
+        #caches from before conversation summaries only stored the name
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(contacts)')]
+        for column, column_type in (('last_preview', 'TEXT'), ('last_time', 'TEXT'), ('unread_count', 'INTEGER DEFAULT 0')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE contacts ADD COLUMN {column} {column_type}')
+        conn.commit()
+        conn.close()
+        
+    def get_messages(self, contact, after_id=0):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT id, sender, content, is_file, file_path, file_hash, timestamp
+                FROM messages
+                WHERE contact = ? AND id > ?
+                ORDER BY id
+            ''', (contact, after_id)).fetchall()
+        finally:
+            conn.close()
+        return [{
+            'id': row[0],
+            'sender': row[1],
+            'content': row[2],
+            'is_file': bool(row[3]),
+            'file_path': row[4],
+            'file_hash': row[5],
+            'timestamp': row[6]
+        } for row in rows]
+        
+    def last_message_id(self, contact):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM messages WHERE contact = ?',
+                                (contact,)).fetchone()[0]
+        finally:
+            conn.close()
+            
+    def add_messages(self, contact, messages):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executemany('''
+                INSERT OR IGNORE INTO messages (id, contact, sender, content, is_file, file_path, file_hash, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(m['id'], contact, m['sender'], m['content'], m.get('is_file', False),
+                   m.get('file_path'), m.get('file_hash'), m.get('timestamp')) for m in messages])
+            conn.commit()
+        finally:
+            conn.close()
+            
+    def get_conversations(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT username, last_preview, last_time, unread_count
+                FROM contacts ORDER BY position
+            ''').fetchall()
+        finally:
+            conn.close()
+        return [{
+            'username': row[0],
+            'last_preview': row[1],
+            'last_time': row[2],
+            'unread_count': row[3] or 0
+        } for row in rows]
+            
+    def set_conversations(self, conversations):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('DELETE FROM contacts')
+            conn.executemany('''
+                INSERT OR REPLACE INTO contacts (username, position, last_preview, last_time, unread_count)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(c['username'], position, c.get('last_preview'), c.get('last_time'), c.get('unread_count', 0))
+                  for position, c in enumerate(conversations)])
+            conn.commit()
+        finally:
+            conn.close()
+
+def attachment_name(file_path):
+    #server paths can come from windows, so split on both separators
+    return os.path.basename(file_path.replace('\\', '/'))
+
+def is_image(file_path):
+    mime_type, _ = mimetypes.guess_type(attachment_name(file_path))
+    return bool(mime_type) and mime_type.startswith('image/')
 
 class MessengerClient:
     def __init__(self):
@@ -16,11 +242,25 @@ class MessengerClient:
         self.current_chat = None
         self.main_socket = None
         
+        #worker pool so socket calls never run on the tk thread
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        #thumbnails get their own small pool so a chat full of images can't starve clicks and sends
+        self.thumbnail_executor = ThreadPoolExecutor(max_workers=2)
+        self.attachment_cache = AttachmentCache(CACHE_DIR, ATTACHMENT_CACHE_MAX_BYTES)
+        self.message_cache = None
+        self.last_displayed_id = 0
+        self.contact_names = []
+        self.downloads = {}
+        self.download_listeners = {}
+        self.file_link_count = 0
+        self.thumbnail_images = []
+        
         #setup main window
         self.root = tk.Tk()
         self.root.title("Messenger")
         self.root.geometry("400x600")
         self.root.configure(bg='#2b2b2b')
+        self.progress_var = tk.StringVar()
         
         #styling
         self.style = ttk.Style()
@@ -37,48 +277,98 @@ class MessengerClient:
             sock.connect(('localhost', 5000))
             return sock
         except Exception as e:
-            messagebox.showerror("Error", f"Could not connect to server: {e}")
-            return None
+            sock.close()
+            raise ConnectionError(f"Could not connect to server: {e}")
             
-    def send_json(self, sock, obj):
+    def send_json(self, sock, obj, progress=None):
         data = json.dumps(obj).encode('utf-8')
-        length = struct.pack('>I', len(data))
-        sock.sendall(length + data)
+        payload = struct.pack('>I', len(data)) + data
+        if not progress:
+            sock.sendall(payload)
+            return
+        #send in chunks so big uploads can report progress
+        view = memoryview(payload)
+        for offset in range(0, len(payload), CHUNK_SIZE):
+            sock.sendall(view[offset:offset + CHUNK_SIZE])
+            progress(min(offset + CHUNK_SIZE, len(payload)), len(payload))
 
-    def recv_json(self, sock):
+    def recv_json(self, sock, progress=None):
         raw_length = self.recvall(sock, 4)
         if not raw_length:
             return None
         length = struct.unpack('>I', raw_length)[0]
-        data = self.recvall(sock, length)
+        data = self.recvall(sock, length, progress)
         if not data:
             return None
         return json.loads(data.decode('utf-8'))
 
-    def recvall(self, sock, n):
-        data = b''
+    def recvall(self, sock, n, progress=None):
+        data = bytearray()
         while len(data) < n:
-            packet = sock.recv(n - len(data))
+            packet = sock.recv(min(n - len(data), CHUNK_SIZE))
             if not packet:
                 return None
             data += packet
-        return data
+            if progress:
+                progress(len(data), n)
+        return bytes(data)
             
-    def send_request(self, request):
+    def send_request(self, request, send_progress=None, recv_progress=None):
+        #blocking, only call this from the worker pool.
+        #progress is reported separately per direction, only the one carrying the file is interesting
         sock = self.create_socket()
-        if not sock:
-            return None
-            
         try:
-            self.send_json(sock, request)
-            response = self.recv_json(sock)
+            self.send_json(sock, request, send_progress)
+            response = self.recv_json(sock, recv_progress)
+            if response is None:
+                raise ConnectionError("Server closed the connection")
             return response
-        except Exception as e:
-            messagebox.showerror("Error", f"Server communication error: {e}")
-            return None
         finally:
             sock.close()
             
+    def schedule(self, func, *args):
+        #hand work back to the tk thread, ignore it if the window is gone
+        try:
+            self.root.after(0, func, *args)
+        except (RuntimeError, tk.TclError):
+            pass
+            
+    def run_in_background(self, func, *args, on_success=None, on_error=None, executor=None):
+        future = (executor or self.executor).submit(func, *args)
+        self.watch_future(future, on_success, on_error)
+        return future
+        
+    def watch_future(self, future, on_success=None, on_error=None):
+        future.add_done_callback(lambda f: self.schedule(self.finish_background, f, on_success, on_error))
+        
+    def finish_background(self, future, on_success, on_error):
+        error = future.exception()
+        if error:
+            if on_error:
+                on_error(error)
+            else:
+                messagebox.showerror("Error", f"Server communication error: {error}")
+        elif on_success:
+            on_success(future.result())
+            
+    def make_progress_reporter(self, label):
+        last_percent = [-1]
+        
+        def report(done, total):
+            percent = int(done * 100 / total) if total else 100
+            #only wake the tk thread when the number actually changes
+            if percent != last_percent[0]:
+                last_percent[0] = percent
+                self.schedule(self.progress_var.set, f"{label}: {percent}%")
+        return report
+        
+    def widget_alive(self, name):
+        widget = getattr(self, name, None)
+        try:
+            return widget is not None and bool(widget.winfo_exists())
+        except tk.TclError:
+            return False
+            
     def show_login_window(self):
         self.clear_window()
         
@@ -101,6 +391,7 @@ class MessengerClient:
         
     def show_contacts_window(self):
         self.clear_window()
+        self.current_chat = None
         
         contacts_frame = ttk.Frame(self.root, style='Dark.TFrame')
         contacts_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -112,6 +403,9 @@ class MessengerClient:
         self.contacts_listbox.pack(fill=tk.BOTH, expand=True)
         self.contacts_listbox.bind('<Double-Button-1>', self.open_chat)
         
+        #show what we had last time right away, the server answer replaces it
+        self.render_contacts(self.message_cache.get_conversations())
+        
         self.refresh_contacts()
         
     def show_chat_window(self, contact):
@@ -140,7 +434,13 @@ class MessengerClient:
         file_button = ttk.Button(input_frame, text="📎", command=self.send_file)
         file_button.pack(side=tk.LEFT, padx=5)
         
+        self.progress_var.set('')
+        progress_label = ttk.Label(chat_frame, textvariable=self.progress_var, style='Dark.TLabel')
+        progress_label.pack(anchor=tk.W)
+        
+        self.show_cached_history(contact)
         self.load_chat_history()
+        self.mark_read(contact)
         
     def clear_window(self):
         for widget in self.root.winfo_children():
@@ -150,34 +450,44 @@ class MessengerClient:
         username = self.username_entry.get()
         password = self.password_entry.get()
         
-        self.main_socket = self.create_socket()
-        if not self.main_socket:
-            return
-            
         request = {
             'action': 'login',
             'username': username,
             'password': password
         }
         
+        self.run_in_background(
+            self.open_session, request,
+            on_success=lambda result: self.finish_login(username, result),
+            on_error=lambda e: messagebox.showerror("Error", f"Login failed: {e}")
+        )
+        
+    def open_session(self, request):
+        #the login socket stays open and becomes the notification channel
+        sock = self.create_socket()
         try:
-            self.send_json(self.main_socket, request)
-            response = self.recv_json(self.main_socket)
+            self.send_json(sock, request)
+            response = self.recv_json(sock)
+        except Exception:
+            sock.close()
+            raise
+        if not response or response['status'] != 'success':
+            sock.close()
+            return None, response
+        return sock, response
+        
+    def finish_login(self, username, result):
+        sock, response = result
+        if not sock:
+            messagebox.showerror("Error", response['message'] if response else "Login failed")
+            return
             
-            if response['status'] == 'success':
-                self.username = username
-                self.show_contacts_window()
-                listener_thread = threading.Thread(target=self.listen_for_messages, daemon=True)
-                listener_thread.start()
-            else:
-                messagebox.showerror("Error", response['message'])
-                self.main_socket.close()
-                self.main_socket = None
-        except Exception as e:
-            if self.main_socket:
-                self.main_socket.close()
-                self.main_socket = None
-            messagebox.showerror("Error", f"Login failed: {e}")
+        self.main_socket = sock
+        self.username = username
+        self.message_cache = MessageCache(CACHE_DIR, username)
+        self.show_contacts_window()
+        listener_thread = threading.Thread(target=self.listen_for_messages, daemon=True)
+        listener_thread.start()
             
     def register(self):
         username = self.username_entry.get()
@@ -189,10 +499,9 @@ class MessengerClient:
             'password': password
         }
         
-        response = self.send_request(request)
-        if not response:
-            return
-            
+        self.run_in_background(self.send_request, request, on_success=self.finish_register)
+        
+    def finish_register(self, response):
         if response['status'] == 'success':
             messagebox.showinfo("Success", "Registration successful! Please login.")
         else:
@@ -208,6 +517,16 @@ class MessengerClient:
         contact_entry = ttk.Entry(dialog, style='Dark.TEntry')
         contact_entry.pack(pady=5)
         
+        def finish_add_contact(response):
+            if response['status'] == 'success':
+                messagebox.showinfo("Success", "Contact added successfully!")
+                if self.widget_alive('contacts_listbox'):
+                    self.refresh_contacts()
+                if dialog.winfo_exists():
+                    dialog.destroy()
+            else:
+                messagebox.showerror("Error", response['message'])
+        
         def add_contact():
             contact_username = contact_entry.get()
             request = {
@@ -216,16 +535,7 @@ class MessengerClient:
                 'contact_username': contact_username
             }
             
-            response = self.send_request(request)
-            if not response:
-                return
-                
-            if response['status'] == 'success':
-                messagebox.showinfo("Success", "Contact added successfully!")
-                self.refresh_contacts()
-                dialog.destroy()
-            else:
-                messagebox.showerror("Error", response['message'])
+            self.run_in_background(self.send_request, request, on_success=finish_add_contact)
                 
         ttk.Button(dialog, text="Add", command=add_contact).pack(pady=5)
         
@@ -235,60 +545,113 @@ class MessengerClient:
             'username': self.username
         }
         
+        self.run_in_background(self.sync_contacts, request, on_success=self.show_contacts)
+        
+    def refresh_contacts_if_visible(self):
+        if self.widget_alive('contacts_listbox'):
+            self.refresh_contacts()
+            
+    def sync_contacts(self, request):
         response = self.send_request(request)
-        if not response:
+        if response['status'] == 'success':
+            self.message_cache.set_conversations(response['conversations'])
+        return response
+        
+    def show_contacts(self, response):
+        #the user may have opened a chat while the request was in flight
+        if not self.widget_alive('contacts_listbox'):
             return
             
         if response['status'] == 'success':
-            self.contacts_listbox.delete(0, tk.END)
-            for contact in response['contacts']:
-                self.contacts_listbox.insert(tk.END, contact)
+            self.render_contacts(response['conversations'])
+            
+    def render_contacts(self, conversations):
+        #the listbox shows badges and previews, so keep the plain names next to it
+        self.contact_names = []
+        self.contacts_listbox.delete(0, tk.END)
+        for conversation in conversations:
+            label = conversation['username']
+            if conversation.get('unread_count'):
+                label += f" ({conversation['unread_count']})"
+            if conversation.get('last_preview'):
+                label += f" - {conversation['last_preview']}"
+            self.contact_names.append(conversation['username'])
+            self.contacts_listbox.insert(tk.END, label)
                 
     def open_chat(self, event):
         selection = self.contacts_listbox.curselection()
         if selection:
-            contact = self.contacts_listbox.get(selection[0])
+            contact = self.contact_names[selection[0]]
             self.show_chat_window(contact)
             
+    def mark_read(self, contact):
+        request = {
+            'action': 'mark_read',
+            'username': self.username,
+            'contact_username': contact
+        }
+        self.run_in_background(self.send_request, request, on_error=lambda e: None)
+            
     def send_message(self):
         message = self.message_entry.get()
         if not message:
             return
             
+        receiver = self.current_chat
         request = {
             'action': 'send_message',
             'sender': self.username,
-            'receiver': self.current_chat,
+            'receiver': receiver,
             'content': message
         }
         
-        send_socket = self.create_socket()
-        if not send_socket:
-            messagebox.showerror("Error", "Could not connect to server")
-            return
-            
-        try:
-            self.send_json(send_socket, request)
-            response = self.recv_json(send_socket)
-            if response['status'] == 'success':
-                self.display_message({
-                    'sender': self.username,
-                    'content': message,
-                    'is_file': False
-                })
-                self.message_entry.delete(0, tk.END)
-            else:
+        def finish_send(response):
+            if response['status'] != 'success':
                 messagebox.showerror("Error", response['message'])
-        except Exception as e:
-            messagebox.showerror("Error", "Failed to send message")
-        finally:
-            send_socket.close()
+                return
+            if self.current_chat != receiver or not self.widget_alive('chat_area'):
+                return
+            if self.message_entry.get() == message:
+                self.message_entry.delete(0, tk.END)
+            #pull it back through the sync so it lands in the cache with its server id
+            self.load_chat_history()
+        
+        self.run_in_background(
+            self.send_request, request,
+            on_success=finish_send,
+            on_error=lambda e: messagebox.showerror("Error", "Failed to send message")
+        )
 
     def send_file(self):
         file_path = filedialog.askopenfilename()
         if not file_path:
             return
             
+        file_name = os.path.basename(file_path)
+        receiver = self.current_chat
+        progress = self.make_progress_reporter(f"Uploading {file_name}")
+        
+        def finish_upload(response):
+            self.progress_var.set('')
+            if response['status'] != 'success':
+                messagebox.showerror("Error", response['message'])
+                return
+            if self.current_chat != receiver or not self.widget_alive('chat_area'):
+                return
+            self.load_chat_history()
+            
+        def upload_failed(error):
+            self.progress_var.set('')
+            messagebox.showerror("Error", "Failed to send file")
+        
+        self.run_in_background(
+            self.upload_file, file_path, receiver, progress,
+            on_success=finish_upload,
+            on_error=upload_failed
+        )
+        
+    def upload_file(self, file_path, receiver, progress=None):
+        #reading and encoding a big file is slow too, keep it off the tk thread
         file_name = os.path.basename(file_path)
         with open(file_path, 'rb') as f:
             file_content = f.read()
@@ -297,56 +660,88 @@ class MessengerClient:
         request = {
             'action': 'send_message',
             'sender': self.username,
-            'receiver': self.current_chat,
+            'receiver': receiver,
             'content': file_name,
             'is_file': True,
             'file_path': file_name,
             'file_content': file_content_b64
         }
+        response = self.send_request(request, send_progress=progress)
+        #we already have the bytes, so our own uploads never need a download
+        if response['status'] == 'success' and response.get('file_path'):
+            key = self.attachment_cache.make_key(response)
+            self.attachment_cache.put(key, file_name, file_content, response.get('file_hash'))
+        return response
+                
+    def show_cached_history(self, contact):
+        messages = self.message_cache.get_messages(contact)
         
-        send_socket = self.create_socket()
-        if not send_socket:
-            messagebox.showerror("Error", "Could not connect to server")
-            return
+        self.chat_area.config(state=tk.NORMAL)
+        self.chat_area.delete(1.0, tk.END)
+        self.last_displayed_id = 0
+        self.thumbnail_images = []
+        
+        for message in messages:
+            self.display_message(message)
+            self.last_displayed_id = message['id']
             
-        try:
-            self.send_json(send_socket, request)
-            response = self.recv_json(send_socket)
-            if response['status'] == 'success':
-                self.display_message({
-                    'sender': self.username,
-                    'content': file_name,
-                    'is_file': True,
-                    'file_path': file_name
-                })
-            else:
-                messagebox.showerror("Error", response['message'])
-        except Exception as e:
-            messagebox.showerror("Error", "Failed to send file")
-        finally:
-            send_socket.close()
-                
+        self.chat_area.config(state=tk.DISABLED)
+        self.chat_area.see(tk.END)
+        
+        self.prefetch_attachments(messages)
+        
     def load_chat_history(self):
+        contact = self.current_chat
+        self.run_in_background(
+            self.sync_chat_history, contact,
+            on_success=lambda response: self.show_chat_history(contact, response)
+        )
+        
+    def sync_chat_history(self, contact):
+        #only ask the server for what the local cache doesn't have yet
         request = {
             'action': 'get_messages',
             'user1': self.username,
-            'user2': self.current_chat
+            'user2': contact,
+            'since_id': self.message_cache.last_message_id(contact)
         }
-        
         response = self.send_request(request)
-        if not response:
+        if response['status'] == 'success':
+            self.message_cache.add_messages(contact, response['messages'])
+        return response
+        
+    def show_chat_history(self, contact, response):
+        if self.current_chat != contact or not self.widget_alive('chat_area'):
             return
             
         if response['status'] == 'success':
+            #syncs can finish out of order, so render from the cache rather than this
+            #response, every finished sync has already stored its messages there
+            new_messages = self.message_cache.get_messages(contact, self.last_displayed_id)
+            if not new_messages:
+                return
+            if any(m['sender'] == contact for m in new_messages):
+                self.mark_read(contact)
+                
             self.chat_area.config(state=tk.NORMAL)
-            self.chat_area.delete(1.0, tk.END)
             
-            for message in response['messages']:
+            for message in new_messages:
                 self.display_message(message)
+                self.last_displayed_id = message['id']
                 
             self.chat_area.config(state=tk.DISABLED)
             self.chat_area.see(tk.END)
             
+            self.prefetch_attachments(new_messages)
+            
+    def prefetch_attachments(self, messages):
+        #warm the cache for the newest few attachments, everything else waits for a click.
+        #images already show a thumbnail, so their originals are only fetched on click
+        files = [m for m in messages
+                 if m.get('is_file') and m.get('file_path') and not is_image(m['file_path'])]
+        for message in files[-PREFETCH_LIMIT:]:
+            self.fetch_attachment(message)
+            
     def display_message(self, message):
         self.chat_area.config(state=tk.NORMAL)
         
@@ -357,19 +752,18 @@ class MessengerClient:
         if message.get('is_file'):
             tag = 'sender' if message['sender'] == self.username else 'receiver'
             self.chat_area.insert(tk.END, f"{message['sender'] if message['sender'] != self.username else 'You'}: ", tag)
-            start = self.chat_area.index(tk.END)
-            self.chat_area.insert(tk.END, f"[File: {message['content']}]\n", (tag, 'file_link'))
-            end = self.chat_area.index(tk.END)
-            self.chat_area.tag_add('file_link', start, end)
-            self.chat_area.tag_bind('file_link', '<Button-1>', lambda e, m=message: self.open_file(m))
-            
-            file_path = message['file_path']
-            local_path = os.path.join(os.getcwd(), os.path.basename(file_path))
-            if not os.path.exists(local_path):
-                file_content_b64 = self.request_file_from_server(file_path)
-                if file_content_b64:
-                    with open(local_path, 'wb') as f:
-                        f.write(base64.b64decode(file_content_b64))
+            #every link gets its own tag so a click opens that message's file
+            self.file_link_count += 1
+            link_tag = f"file_link_{self.file_link_count}"
+            self.chat_area.insert(tk.END, f"[File: {message['content']}]\n", (tag, 'file_link', link_tag))
+            self.chat_area.tag_bind(link_tag, '<Button-1>', lambda e, m=message: self.open_file(m))
+            
+            if message.get('file_path') and is_image(message['file_path']):
+                #the preview is dropped in at this mark once it arrives
+                mark = f"thumbnail_{self.file_link_count}"
+                self.chat_area.mark_set(mark, 'end-1c')
+                self.chat_area.mark_gravity(mark, tk.LEFT)
+                self.load_thumbnail(message, mark, link_tag)
         else:
             if message['sender'] == self.username:
                 self.chat_area.insert(tk.END, f"You: {message['content']}\n", 'sender')
@@ -379,6 +773,61 @@ class MessengerClient:
         self.chat_area.config(state=tk.DISABLED)
         self.chat_area.see(tk.END)
         
+    def load_thumbnail(self, message, mark, link_tag, attempt=0):
+        contact = self.current_chat
+        self.run_in_background(
+            self.fetch_thumbnail, message, contact,
+            on_success=lambda result: self.show_thumbnail(contact, message, mark, link_tag, attempt, result),
+            on_error=lambda e: None,
+            executor=self.thumbnail_executor
+        )
+        
+    def fetch_thumbnail(self, message, contact):
+        #the user may have left the chat while this was queued
+        if self.current_chat != contact:
+            return {'state': 'skipped'}
+            
+        key = 'thumb_' + self.attachment_cache.make_key(message)
+        local_path = self.attachment_cache.get(key)
+        if local_path:
+            return {'state': 'ready', 'local_path': local_path}
+            
+        request = {
+            'action': 'get_thumbnail',
+            'file_path': message['file_path']
+        }
+        response = self.send_request(request)
+        if response['status'] != 'success':
+            raise RuntimeError(response['message'])
+        if response.get('thumbnail'):
+            data = base64.b64decode(response['thumbnail'])
+            response['local_path'] = self.attachment_cache.put(key, 'thumbnail.png', data)
+        return response
+        
+    def show_thumbnail(self, contact, message, mark, link_tag, attempt, result):
+        if self.current_chat != contact or not self.widget_alive('chat_area'):
+            return
+        if mark not in self.chat_area.mark_names():
+            return
+            
+        if result.get('local_path'):
+            image = tk.PhotoImage(file=result['local_path'])
+            #tk only keeps a weak hold on images, so keep a reference around
+            self.thumbnail_images.append(image)
+            self.chat_area.config(state=tk.NORMAL)
+            self.chat_area.image_create(mark, image=image)
+            self.chat_area.insert(f"{mark} + 1c", '\n')
+            self.chat_area.tag_add(link_tag, mark, f"{mark} + 1c")
+            self.chat_area.config(state=tk.DISABLED)
+        elif result.get('state') == 'pending' and attempt < THUMBNAIL_RETRIES:
+            self.root.after(THUMBNAIL_RETRY_MS, self.load_thumbnail, message, mark, link_tag, attempt + 1)
+        elif result.get('width') and result.get('height'):
+            #no preview on this server, at least say what the file is
+            info = f"{result['width']}x{result['height']}, {(result.get('size') or 0) // 1024} KB\n"
+            self.chat_area.config(state=tk.NORMAL)
+            self.chat_area.insert(mark, info, 'receiver')
+            self.chat_area.config(state=tk.DISABLED)
+        
     def open_file_crossplatform(self, path):
         if sys.platform.startswith('darwin'):
             subprocess.call(('open', path))
@@ -388,38 +837,65 @@ class MessengerClient:
             subprocess.call(('xdg-open', path))
 
     def open_file(self, message):
-        file_path = message['file_path']
-        local_path = os.path.join(os.getcwd(), os.path.basename(file_path))
-        if not os.path.exists(local_path):
-            file_content_b64 = self.request_file_from_server(file_path)
-            if file_content_b64:
-                with open(local_path, 'wb') as f:
-                    f.write(base64.b64decode(file_content_b64))
-            else:
-                messagebox.showerror("Error", f"Could not download file {file_path}")
-                return
-        self.open_file_crossplatform(local_path)
-        
-    def request_file_from_server(self, file_path):
+        file_name = attachment_name(message['file_path'])
+        key = self.attachment_cache.make_key(message)
+        local_path = self.attachment_cache.get(key)
+        if local_path:
+            self.open_file_crossplatform(local_path)
+            return
+            
+        def finish_download(path):
+            self.progress_var.set('')
+            self.open_file_crossplatform(path)
+            
+        def download_failed(error):
+            self.progress_var.set('')
+            messagebox.showerror("Error", f"Could not download file {file_name}: {error}")
+            
+        progress = self.make_progress_reporter(f"Downloading {file_name}")
+        future = self.fetch_attachment(message, progress)
+        self.watch_future(future, on_success=finish_download, on_error=download_failed)
+        
+    def fetch_attachment(self, message, progress=None):
+        #share one download between a prefetch and a click on the same file,
+        #a click joining a running prefetch still gets its progress shown
+        key = self.attachment_cache.make_key(message)
+        future = self.downloads.get(key)
+        if future is None:
+            self.download_listeners[key] = []
+            future = self.executor.submit(self.download_attachment, message, key,
+                                          lambda done, total: self.report_download_progress(key, done, total))
+            self.downloads[key] = future
+            future.add_done_callback(lambda f: self.schedule(self.finish_fetch, key))
+        if progress:
+            self.download_listeners[key].append(progress)
+        return future
+        
+    def report_download_progress(self, key, done, total):
+        #called on the worker thread, copy the list since the tk thread may add to it
+        for progress in list(self.download_listeners.get(key, [])):
+            progress(done, total)
+            
+    def finish_fetch(self, key):
+        self.downloads.pop(key, None)
+        self.download_listeners.pop(key, None)
+        
+    def download_attachment(self, message, key, progress=None):
+        local_path = self.attachment_cache.get(key)
+        if local_path:
+            return local_path
+            
         request = {
             'action': 'get_file',
-            'file_path': file_path
+            'file_path': message['file_path']
         }
-        sock = self.create_socket()
-        if not sock:
-            return None
-        try:
-            self.send_json(sock, request)
-            response = self.recv_json(sock)
-            if response['status'] == 'success':
-                return response['file_content']
-            else:
-                return None
-        except Exception as e:
-            messagebox.showerror("Error", f"File download error: {e}")
-            return None
-        finally:
-            sock.close()
+        response = self.send_request(request, recv_progress=progress)
+        if response['status'] != 'success':
+            raise RuntimeError(response['message'])
+            
+        data = base64.b64decode(response['file_content'])
+        expected_hash = message.get('file_hash') or response.get('file_hash')
+        return self.attachment_cache.put(key, attachment_name(message['file_path']), data, expected_hash)
         
     def listen_for_messages(self):
         while True:
@@ -434,6 +910,8 @@ class MessengerClient:
                     if self.current_chat == other_user:
                         self.root.after(0, self.load_chat_history)
                     else:
+                        #bump the unread badge if the contact list is on screen
+                        self.root.after(0, self.refresh_contacts_if_visible)
                         self.root.after(0, lambda: messagebox.showinfo(
                             "New Message",
                             f"New message from {message['sender']}: {message['content']}"
@@ -443,6 +921,8 @@ class MessengerClient:
                 
     def run(self):
         self.root.mainloop()
+        self.executor.shutdown(wait=False)
+        self.thumbnail_executor.shutdown(wait=False)
 
 if __name__ == '__main__':
     client = MessengerClient()
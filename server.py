@@ -3,22 +3,58 @@ import threading
 import sqlite3
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import base64
 import struct
+import hashlib
+import mimetypes
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THUMBNAIL_SIZE = (200, 200)
+PREVIEW_LENGTH = 80
+
+#messages older than this move to the archive databases, None keeps everything live
+RETENTION_DAYS = 365
+RETENTION_INTERVAL = 60 * 60
+RETENTION_PAUSE = 0.05
+ARCHIVE_DIR = 'archive'
+ARCHIVE_BATCH_SIZE = 500
+FILE_GRACE_PERIOD = 60 * 60
+VACUUM_PAGES = 100
 
 class MessengerServer:
-    def __init__(self, host='0.0.0.0', port=5000):
+    def __init__(self, host='0.0.0.0', port=5000, retention_days=RETENTION_DAYS):
         self.host = host
         self.port = port
+        self.retention_days = retention_days
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.clients = {}  
+        #thumbnails are generated here so uploads return right away
+        self.image_pool = ThreadPoolExecutor(max_workers=2)
         self.initialize_database()
+        #lets delta syncs skip the archive files when they only want new messages
+        self.archive_max_id = self.find_archive_max_id()
         
     def initialize_database(self):
         conn = sqlite3.connect('messenger.db')
         cursor = conn.cursor()
         
+        #WAL keeps readers going while the retention thread writes
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
+        #incremental auto vacuum has to be switched on once with a full VACUUM
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        
         #create tables
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -54,6 +90,85 @@ class MessengerServer:
         )
         ''')
         
+        #older databases were created before files had a content hash
+        cursor.execute('PRAGMA table_info(messages)')
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'file_hash' not in columns:
+            cursor.execute('ALTER TABLE messages ADD COLUMN file_hash TEXT')
+        
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attachments (
+            file_path TEXT PRIMARY KEY,
+            file_hash TEXT,
+            mime_type TEXT,
+            size INTEGER,
+            width INTEGER,
+            height INTEGER,
+            thumbnail_path TEXT,
+            status TEXT DEFAULT 'pending'
+        )
+        ''')
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'conversations'")
+        conversations_exist = cursor.fetchone() is not None
+        
+        #one row per user and chat partner, kept up to date by send_message
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            user_id INTEGER NOT NULL,
+            contact_id INTEGER NOT NULL,
+            last_message_id INTEGER,
+            last_preview TEXT,
+            last_time TIMESTAMP,
+            unread_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, contact_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (contact_id) REFERENCES users (id)
+        )
+        ''')
+        
+        if not conversations_exist:
+            #fill the summaries from existing history, old messages count as read
+            cursor.execute('''
+            SELECT pair.user_id, pair.contact_id, m.id, m.content, m.is_file, m.created_at
+            FROM (
+                SELECT user_id, contact_id, MAX(id) AS last_id
+                FROM (
+                    SELECT sender_id AS user_id, receiver_id AS contact_id, id FROM messages
+                    UNION ALL
+                    SELECT receiver_id AS user_id, sender_id AS contact_id, id FROM messages
+                )
+                GROUP BY user_id, contact_id
+            ) pair
+            JOIN messages m ON m.id = pair.last_id
+            ''')
+            summaries = [(user_id, contact_id, message_id, self.make_preview(content, is_file), created_at)
+                         for user_id, contact_id, message_id, content, is_file, created_at in cursor.fetchall()]
+            cursor.executemany('''
+            INSERT INTO conversations (user_id, contact_id, last_message_id, last_preview, last_time)
+            VALUES (?, ?, ?, ?, ?)
+            ''', summaries)
+        
+        #get_contacts reaches conversations through its primary key, an extra index only slows inserts
+        cursor.execute('DROP INDEX IF EXISTS idx_conversations_recent')
+        
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_contacts_user
+        ON contacts (user_id, contact_id)
+        ''')
+        
+        #delta syncs look up one conversation by id
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_pair
+        ON messages (sender_id, receiver_id, id)
+        ''')
+        
+        #the retention engine looks for old messages by date
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_messages_created
+        ON messages (created_at)
+        ''')
+        
         conn.commit()
         conn.close()
         
@@ -66,6 +181,10 @@ class MessengerServer:
         self.server_socket.listen(5)
         print(f"Server started on {self.host}:{self.port}")
         
+        if self.retention_days is not None:
+            retention_thread = threading.Thread(target=self.retention_loop, daemon=True)
+            retention_thread.start()
+        
         while True:
             client_socket, address = self.server_socket.accept()
             client_thread = threading.Thread(target=self.handle_client, args=(client_socket, address))
@@ -109,6 +228,10 @@ class MessengerServer:
             return self.get_messages(request)
         elif action == 'get_file':
             return self.get_file(request)
+        elif action == 'get_thumbnail':
+            return self.get_thumbnail(request)
+        elif action == 'mark_read':
+            return self.mark_read(request)
         else:
             return {'status': 'error', 'message': 'Invalid action'}
 
@@ -193,16 +316,30 @@ class MessengerServer:
             
             username = request.get('username')
             
+            #most recent chats first, contacts without messages go last
             cursor.execute('''
-                SELECT u.username 
-                FROM users u
-                JOIN contacts c ON u.id = c.contact_id
-                JOIN users u2 ON c.user_id = u2.id
+                SELECT u.username, cv.last_message_id, cv.last_preview, cv.last_time,
+                       COALESCE(cv.unread_count, 0)
+                FROM users u2
+                JOIN contacts c ON c.user_id = u2.id
+                JOIN users u ON u.id = c.contact_id
+                LEFT JOIN conversations cv ON cv.user_id = c.user_id AND cv.contact_id = c.contact_id
                 WHERE u2.username = ?
+                ORDER BY COALESCE(cv.last_message_id, 0) DESC, u.username
             ''', (username,))
             
-            contacts = [row[0] for row in cursor.fetchall()]
-            return {'status': 'success', 'contacts': contacts}
+            conversations = []
+            for row in cursor.fetchall():
+                conversations.append({
+                    'username': row[0],
+                    'last_message_id': row[1],
+                    'last_preview': row[2],
+                    'last_time': row[3],
+                    'unread_count': row[4]
+                })
+            
+            contacts = [conversation['username'] for conversation in conversations]
+            return {'status': 'success', 'contacts': contacts, 'conversations': conversations}
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
         finally:
@@ -217,14 +354,21 @@ class MessengerServer:
             content = request.get('content')
             is_file = request.get('is_file', False)
             file_path = request.get('file_path', None)
+            file_hash = None
             
             #handle file upload
             if is_file and 'file_content' in request and file_path:
                 file_content_b64 = request['file_content']
                 file_bytes = base64.b64decode(file_content_b64)
-                save_path = os.path.join('files', file_path)
-                with open(save_path, 'wb') as f:
-                    f.write(file_bytes)
+                file_hash = hashlib.sha256(file_bytes).hexdigest()
+                #prefix with the hash so two uploads with the same name don't overwrite each other
+                save_path = os.path.join('files', f"{file_hash[:16]}_{os.path.basename(file_path)}")
+                if not os.path.exists(save_path):
+                    with open(save_path, 'wb') as f:
+                        f.write(file_bytes)
+                else:
+                    #a reused file counts as fresh so the garbage collector doesn't race this message
+                    os.utime(save_path)
                 file_path = save_path
             
             #get user ids
@@ -236,10 +380,14 @@ class MessengerServer:
             
             #save message
             cursor.execute('''
-                INSERT INTO messages (sender_id, receiver_id, content, file_path, is_file)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (sender_id, receiver_id, content, file_path, is_file))
+                INSERT INTO messages (sender_id, receiver_id, content, file_path, is_file, file_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (sender_id, receiver_id, content, file_path, is_file, file_hash))
+            self.update_conversations(cursor, cursor.lastrowid, sender_id, receiver_id, content, is_file)
+            new_image = bool(file_hash) and self.is_image(file_path) and self.add_attachment(cursor, file_path, file_hash)
             conn.commit()
+            if new_image:
+                self.image_pool.submit(self.process_image, file_path)
             
             #notify receiver if online
             if receiver in self.clients:
@@ -250,11 +398,61 @@ class MessengerServer:
                     'receiver': receiver,
                     'content': content,
                     'is_file': is_file,
-                    'file_path': file_path
+                    'file_path': file_path,
+                    'file_hash': file_hash
                 }
                 self.send_json(receiver_socket, notification)
             
-            return {'status': 'success', 'message': 'Message sent successfully'}
+            return {
+                'status': 'success',
+                'message': 'Message sent successfully',
+                'file_path': file_path,
+                'file_hash': file_hash
+            }
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+        finally:
+            conn.close()
+
+    def make_preview(self, content, is_file):
+        #one line for the contact list, whitespace and newlines collapse to single spaces
+        preview = f"[File: {content}]" if is_file else (content or '')
+        return ' '.join(preview.split())[:PREVIEW_LENGTH]
+
+    def update_conversations(self, cursor, message_id, sender_id, receiver_id, content, is_file):
+        #keep the per-user summary in step with messages so the contact list is one query
+        preview = self.make_preview(content, is_file)
+        rows = [(sender_id, receiver_id, 0)]
+        #a note to yourself is one row and should never show as unread
+        if receiver_id != sender_id:
+            rows.append((receiver_id, sender_id, 1))
+        for user_id, contact_id, unread in rows:
+            cursor.execute('''
+                INSERT INTO conversations (user_id, contact_id, last_message_id, last_preview, last_time, unread_count)
+                VALUES (?, ?, ?, ?, (SELECT created_at FROM messages WHERE id = ?), ?)
+                ON CONFLICT (user_id, contact_id) DO UPDATE SET
+                    last_message_id = excluded.last_message_id,
+                    last_preview = excluded.last_preview,
+                    last_time = excluded.last_time,
+                    unread_count = unread_count + excluded.unread_count
+            ''', (user_id, contact_id, message_id, preview, message_id, unread))
+
+    def mark_read(self, request):
+        try:
+            conn = sqlite3.connect('messenger.db')
+            cursor = conn.cursor()
+            
+            username = request.get('username')
+            contact_username = request.get('contact_username')
+            
+            cursor.execute('''
+                UPDATE conversations SET unread_count = 0
+                WHERE user_id = (SELECT id FROM users WHERE username = ?)
+                  AND contact_id = (SELECT id FROM users WHERE username = ?)
+            ''', (username, contact_username))
+            conn.commit()
+            
+            return {'status': 'success', 'message': 'Conversation marked as read'}
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
         finally:
@@ -267,6 +465,11 @@ class MessengerServer:
             
             user1 = request.get('user1')
             user2 = request.get('user2')
+            #clients with a local cache only ask for messages newer than this id
+            since_id = request.get('since_id') or 0
+            #paging backwards: newest `limit` messages older than before_id
+            before_id = request.get('before_id') or (1 << 62)
+            limit = request.get('limit')
             
             #get user ids
             cursor.execute('SELECT id FROM users WHERE username = ?', (user1,))
@@ -275,32 +478,267 @@ class MessengerServer:
             cursor.execute('SELECT id FROM users WHERE username = ?', (user2,))
             user2_id = cursor.fetchone()[0]
             
-            #get messages between users
-            cursor.execute('''
-                SELECT u.username, m.content, m.is_file, m.file_path, m.created_at
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE (m.sender_id = ? AND m.receiver_id = ?)
-                   OR (m.sender_id = ? AND m.receiver_id = ?)
-                ORDER BY m.created_at
-            ''', (user1_id, user2_id, user2_id, user1_id))
+            #get messages between users, newest first so a limit keeps the latest ones
+            query = '''
+                SELECT id, sender_id, content, is_file, file_path, created_at, file_hash
+                FROM messages
+                WHERE ((sender_id = ? AND receiver_id = ?)
+                   OR (sender_id = ? AND receiver_id = ?))
+                  AND id > ? AND id < ?
+                ORDER BY id DESC
+            '''
+            params = [user1_id, user2_id, user2_id, user1_id, since_id, before_id]
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            
+            #older history may have moved to the archive databases
+            if (not limit or len(rows) < limit) and since_id < self.archive_max_id:
+                #a batch that is archived but not yet deleted shows up in both reads, keep each id once
+                combined = {row[0]: row for row in self.fetch_archived_messages(user1_id, user2_id, since_id,
+                                                                               before_id, limit)}
+                combined.update((row[0], row) for row in rows)
+                rows = sorted(combined.values(), key=lambda row: row[0], reverse=True)
+                if limit:
+                    rows = rows[:limit]
             
+            names = {user1_id: user1, user2_id: user2}
             messages = []
-            for row in cursor.fetchall():
+            for row in reversed(rows):
                 messages.append({
-                    'sender': row[0],
-                    'content': row[1],
-                    'is_file': bool(row[2]),
-                    'file_path': row[3],
-                    'timestamp': row[4]
+                    'id': row[0],
+                    'sender': names.get(row[1]),
+                    'content': row[2],
+                    'is_file': bool(row[3]),
+                    'file_path': row[4],
+                    'timestamp': row[5],
+                    'file_hash': row[6]
                 })
             
-            return {'status': 'success', 'messages': messages}
+            response = {'status': 'success', 'messages': messages}
+            if limit:
+                response['has_more'] = len(rows) == limit
+            return response
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
         finally:
             conn.close()
 
+    def retention_loop(self):
+        while True:
+            try:
+                self.run_retention()
+            except Exception as e:
+                print(f"Error running retention: {e}")
+            time.sleep(RETENTION_INTERVAL)
+
+    def run_retention(self):
+        self.archive_old_messages()
+        self.collect_unreferenced_files()
+        self.incremental_vacuum()
+
+    def archive_path(self, partition):
+        return os.path.join(ARCHIVE_DIR, f"messages_{partition}.db")
+
+    def archive_paths(self):
+        #newest partition first, the names sort by month
+        if not os.path.exists(ARCHIVE_DIR):
+            return []
+        names = sorted((name for name in os.listdir(ARCHIVE_DIR)
+                        if name.startswith('messages_') and name.endswith('.db')), reverse=True)
+        return [os.path.join(ARCHIVE_DIR, name) for name in names]
+
+    def open_archive(self, partition):
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        conn = sqlite3.connect(self.archive_path(partition))
+        #messages are stored as zlib blocks, one per conversation and batch, so
+        #short chat lines compress together instead of growing one by one
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS message_blocks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            low_user_id INTEGER,
+            high_user_id INTEGER,
+            min_message_id INTEGER,
+            max_message_id INTEGER,
+            data BLOB
+        )
+        ''')
+        conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_blocks_pair
+        ON message_blocks (low_user_id, high_user_id, max_message_id)
+        ''')
+        #file paths stay readable so the garbage collector doesn't have to unpack blocks
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS files (
+            file_path TEXT PRIMARY KEY
+        )
+        ''')
+        return conn
+
+    def find_archive_max_id(self):
+        max_id = 0
+        for path in self.archive_paths():
+            conn = sqlite3.connect(path)
+            try:
+                max_id = max(max_id, conn.execute('SELECT COALESCE(MAX(max_message_id), 0) FROM message_blocks').fetchone()[0])
+            finally:
+                conn.close()
+        return max_id
+
+    def archive_old_messages(self):
+        #created_at is stored in UTC by CURRENT_TIMESTAMP
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+        
+        while True:
+            conn = sqlite3.connect('messenger.db')
+            try:
+                rows = conn.execute('''
+                    SELECT id, sender_id, receiver_id, content, file_path, is_file, created_at, file_hash
+                    FROM messages
+                    WHERE created_at < ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (cutoff, ARCHIVE_BATCH_SIZE)).fetchall()
+                if not rows:
+                    return
+                
+                #group by month, then by conversation, each group becomes one compressed block
+                partitions = {}
+                for row in rows:
+                    partition = row[6][:7].replace('-', '_')
+                    pair = (min(row[1], row[2]), max(row[1], row[2]))
+                    partitions.setdefault(partition, {}).setdefault(pair, []).append(row)
+                
+                #write the archive first, a crash before the delete only leaves duplicates that reads skip
+                for partition, blocks in partitions.items():
+                    archive_conn = self.open_archive(partition)
+                    try:
+                        for (low_user_id, high_user_id), block_rows in blocks.items():
+                            data = zlib.compress(json.dumps(block_rows).encode('utf-8'), 9)
+                            archive_conn.execute('''
+                                INSERT INTO message_blocks
+                                (low_user_id, high_user_id, min_message_id, max_message_id, data)
+                                VALUES (?, ?, ?, ?, ?)
+                            ''', (low_user_id, high_user_id, block_rows[0][0], block_rows[-1][0], data))
+                        archive_conn.executemany('INSERT OR IGNORE INTO files (file_path) VALUES (?)',
+                                                 [(row[4],) for block_rows in blocks.values() for row in block_rows if row[4]])
+                        archive_conn.commit()
+                    finally:
+                        archive_conn.close()
+                
+                #readers must start looking in the archive before the live rows disappear
+                self.archive_max_id = max(self.archive_max_id, rows[-1][0])
+                conn.executemany('DELETE FROM messages WHERE id = ?', [(row[0],) for row in rows])
+                conn.commit()
+            finally:
+                conn.close()
+            
+            #small batches with a pause so live requests get the write lock in between
+            time.sleep(RETENTION_PAUSE)
+
+    def fetch_archived_messages(self, user1_id, user2_id, since_id, before_id, limit):
+        low_user_id, high_user_id = min(user1_id, user2_id), max(user1_id, user2_id)
+        blocks = []
+        for path in self.archive_paths():
+            conn = sqlite3.connect(path)
+            try:
+                blocks += conn.execute('''
+                    SELECT max_message_id, data FROM message_blocks
+                    WHERE low_user_id = ? AND high_user_id = ?
+                      AND max_message_id > ? AND min_message_id < ?
+                ''', (low_user_id, high_user_id, since_id, before_id)).fetchall()
+            finally:
+                conn.close()
+        
+        #newest blocks first, stop unpacking once no remaining block can make the limit
+        blocks.sort(key=lambda block: block[0], reverse=True)
+        rows = {}
+        for max_message_id, data in blocks:
+            if limit is not None and len(rows) >= limit and max_message_id < sorted(rows, reverse=True)[limit - 1]:
+                break
+            for message_id, sender_id, _, content, file_path, is_file, created_at, file_hash in json.loads(zlib.decompress(data)):
+                if since_id < message_id < before_id:
+                    #keyed by id so a block archived twice after a crash shows up once
+                    rows[message_id] = (message_id, sender_id, content, is_file, file_path, created_at, file_hash)
+        
+        rows = sorted(rows.values(), key=lambda row: row[0], reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+    def collect_unreferenced_files(self):
+        #gather every file path still used by an archived message
+        archived = set()
+        for path in self.archive_paths():
+            archive_conn = sqlite3.connect(path)
+            try:
+                for (file_path,) in archive_conn.execute('SELECT file_path FROM files'):
+                    archived.add(file_path)
+            finally:
+                archive_conn.close()
+        
+        #and by a live one
+        referenced = {os.path.normpath(file_path.replace('\\', '/')) for file_path in archived}
+        conn = sqlite3.connect('messenger.db')
+        try:
+            for (file_path,) in conn.execute('SELECT DISTINCT file_path FROM messages WHERE file_path IS NOT NULL'):
+                referenced.add(os.path.normpath(file_path.replace('\\', '/')))
+        finally:
+            conn.close()
+        
+        now = time.time()
+        for name in os.listdir('files'):
+            path = os.path.join('files', name)
+            #an upload is written to disk just before its message row, leave fresh files alone
+            if path in referenced or now - os.path.getmtime(path) < FILE_GRACE_PERIOD:
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error removing {path}: {e}")
+        
+        conn = sqlite3.connect('messenger.db')
+        try:
+            candidates = conn.execute('''
+                SELECT file_path FROM attachments
+                WHERE file_path NOT IN (SELECT file_path FROM messages WHERE file_path IS NOT NULL)
+            ''').fetchall()
+            for (file_path,) in candidates:
+                if file_path in archived:
+                    continue
+                #check messages again inside the delete, an upload may have committed since the select
+                conn.execute('''
+                    DELETE FROM attachments
+                    WHERE file_path = ?
+                      AND NOT EXISTS (SELECT 1 FROM messages WHERE file_path = ?)
+                ''', (file_path, file_path))
+                conn.commit()
+            thumbnails_in_use = {row[0] for row in conn.execute(
+                'SELECT thumbnail_path FROM attachments WHERE thumbnail_path IS NOT NULL')}
+        finally:
+            conn.close()
+        
+        #drop thumbnails no attachment row points to anymore, fresh ones may still be getting their row
+        if os.path.exists('thumbnails'):
+            for name in os.listdir('thumbnails'):
+                path = os.path.join('thumbnails', name)
+                if path in thumbnails_in_use or now - os.path.getmtime(path) < FILE_GRACE_PERIOD:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error removing {path}: {e}")
+
+    def incremental_vacuum(self):
+        #give freed pages back a little at a time instead of one long VACUUM
+        conn = sqlite3.connect('messenger.db')
+        try:
+            while conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+                conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})').fetchall()
+                time.sleep(RETENTION_PAUSE)
+        finally:
+            conn.close()
+
     def get_file(self, request):
         try:
             file_path = request.get('file_path')
@@ -316,11 +754,128 @@ class MessengerServer:
             
             return {
                 'status': 'success',
-                'file_content': file_content_b64
+                'file_content': file_content_b64,
+                'file_hash': hashlib.sha256(file_content).hexdigest()
             }
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    def is_image(self, file_path):
+        mime_type, _ = mimetypes.guess_type(file_path)
+        return bool(mime_type) and mime_type.startswith('image/')
+
+    def add_attachment(self, cursor, file_path, file_hash):
+        #the caller hands the path to the image pool once this row is committed
+        mime_type, _ = mimetypes.guess_type(file_path)
+        cursor.execute('''
+            INSERT OR IGNORE INTO attachments (file_path, file_hash, mime_type, status)
+            VALUES (?, ?, ?, 'pending')
+        ''', (file_path, file_hash, mime_type))
+        return cursor.rowcount > 0
+
+    def process_image(self, file_path):
+        #runs in the image pool, never on a client thread
+        conn = sqlite3.connect('messenger.db')
+        try:
+            size = os.path.getsize(file_path)
+            width, height = self.read_image_size(file_path)
+            thumbnail_path = None
+            
+            if Image is not None:
+                os.makedirs('thumbnails', exist_ok=True)
+                #one thumbnail per attachment row, the same bytes under another name get their own file
+                attachment_key = hashlib.sha256(file_path.encode('utf-8')).hexdigest()
+                thumbnail_path = os.path.join('thumbnails', f"{attachment_key[:16]}.png")
+                with Image.open(file_path) as img:
+                    width, height = img.size
+                    if img.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                        img = img.convert('RGB')
+                    img.thumbnail(THUMBNAIL_SIZE)
+                    img.save(thumbnail_path, 'PNG')
+            
+            status = 'ready' if thumbnail_path else 'no_thumbnail'
+            conn.execute('''
+                UPDATE attachments
+                SET size = ?, width = ?, height = ?, thumbnail_path = ?, status = ?
+                WHERE file_path = ?
+            ''', (size, width, height, thumbnail_path, status, file_path))
+            conn.commit()
+        except Exception as e:
+            print(f"Error processing image {file_path}: {e}")
+            conn.execute("UPDATE attachments SET status = 'failed' WHERE file_path = ?", (file_path,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def read_image_size(self, file_path):
+        #header parsing so dimensions work even without Pillow
+        with open(file_path, 'rb') as f:
+            head = f.read(26)
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                return struct.unpack('>II', head[16:24])
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', head[6:10])
+            if head.startswith(b'\xff\xd8'):
+                f.seek(2)
+                while True:
+                    marker = f.read(2)
+                    if len(marker) < 2 or marker[0] != 0xFF:
+                        break
+                    segment_length = struct.unpack('>H', f.read(2))[0]
+                    #SOF markers carry the frame size, C4/C8/CC are not frames
+                    if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                        height, width = struct.unpack('>xHH', f.read(5))
+                        return width, height
+                    f.seek(segment_length - 2, os.SEEK_CUR)
+        return None, None
+
+    def get_thumbnail(self, request):
+        try:
+            conn = sqlite3.connect('messenger.db')
+            cursor = conn.cursor()
+            
+            file_path = request.get('file_path')
+            if not file_path:
+                return {'status': 'error', 'message': 'No file path provided'}
+            
+            cursor.execute('''
+                SELECT mime_type, size, width, height, thumbnail_path, status
+                FROM attachments WHERE file_path = ?
+            ''', (file_path,))
+            row = cursor.fetchone()
+            
+            if not row:
+                #files uploaded before the pipeline existed get processed on first request
+                cursor.execute('SELECT file_hash FROM messages WHERE file_path = ? AND is_file = 1 LIMIT 1',
+                             (file_path,))
+                message = cursor.fetchone()
+                if not message or not os.path.exists(file_path):
+                    return {'status': 'error', 'message': 'File not found'}
+                if not self.is_image(file_path):
+                    return {'status': 'error', 'message': 'Not an image'}
+                if self.add_attachment(cursor, file_path, message[0]):
+                    conn.commit()
+                    self.image_pool.submit(self.process_image, file_path)
+                return {'status': 'success', 'state': 'pending'}
+            
+            mime_type, size, width, height, thumbnail_path, state = row
+            response = {
+                'status': 'success',
+                'state': state,
+                'mime_type': mime_type,
+                'size': size,
+                'width': width,
+                'height': height
+            }
+            if state == 'ready':
+                with open(thumbnail_path, 'rb') as f:
+                    response['thumbnail'] = base64.b64encode(f.read()).decode('utf-8')
+            return response
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+        finally:
+            conn.close()
+
     def send_json(self, sock, obj):
         data = json.dumps(obj).encode('utf-8')
         length = struct.pack('>I', len(data))